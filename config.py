@@ -1,28 +1,68 @@
 # config.py
 import os
-from dotenv import load_dotenv
+from functools import cache
+from types import MappingProxyType
+try:
+    from dotenv import load_dotenv
+except ImportError: # python-dotenv is optional, plain environment variables still work
+    def load_dotenv():
+        return False
 
+@cache
 def load_configuration():
-    """Loads configuration from environment variables."""
+    """Loads configuration from environment variables (parsed once per process)."""
     load_dotenv()
     return {
         "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
         "endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
         "deployment": os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-        "default_server_script": "server.py" # Default script name
+        "default_server_script": "server.py", # Default script name
+        # Show tracebacks of failed MCP tool calls in the chat
+        "debug": os.getenv("MCP_CLIENT_DEBUG", "").lower() in ("1", "true", "yes"),
     }
 
-# Load configuration once when the module is imported
-APP_CONFIG = load_configuration()
+# Load configuration once when the module is imported.
+# The mapping is read-only; use set_azure_config() to change it.
+APP_CONFIG = MappingProxyType(load_configuration())
+
+# Cached values so the accessors below are plain global reads
+API_KEY = APP_CONFIG["api_key"]
+ENDPOINT = APP_CONFIG["endpoint"]
+DEPLOYMENT = APP_CONFIG["deployment"]
+DEFAULT_SERVER_SCRIPT = APP_CONFIG["default_server_script"]
+
+def reload_configuration():
+    """Re-reads the environment/.env file and refreshes the cached values."""
+    global APP_CONFIG, API_KEY, ENDPOINT, DEPLOYMENT, DEFAULT_SERVER_SCRIPT
+    load_configuration.cache_clear()
+    APP_CONFIG = MappingProxyType(load_configuration())
+    API_KEY = APP_CONFIG["api_key"]
+    ENDPOINT = APP_CONFIG["endpoint"]
+    DEPLOYMENT = APP_CONFIG["deployment"]
+    DEFAULT_SERVER_SCRIPT = APP_CONFIG["default_server_script"]
+    return APP_CONFIG
+
+def set_azure_config(api_key, endpoint, deployment):
+    """Replaces the Azure settings and refreshes the cached values."""
+    global APP_CONFIG, API_KEY, ENDPOINT, DEPLOYMENT
+    APP_CONFIG = MappingProxyType({
+        **APP_CONFIG,
+        "api_key": api_key,
+        "endpoint": endpoint,
+        "deployment": deployment,
+    })
+    API_KEY = api_key
+    ENDPOINT = endpoint
+    DEPLOYMENT = deployment
 
 def get_api_key():
-    return APP_CONFIG.get("api_key")
+    return API_KEY
 
 def get_endpoint():
-    return APP_CONFIG.get("endpoint")
+    return ENDPOINT
 
 def get_deployment():
-    return APP_CONFIG.get("deployment")
+    return DEPLOYMENT
 
 def get_default_server_script():
-    return APP_CONFIG.get("default_server_script")
\ No newline at end of file
+    return DEFAULT_SERVER_SCRIPT
\ No newline at end of file
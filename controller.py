@@ -2,12 +2,10 @@
 import asyncio
 import json
 import traceback
-from config import APP_CONFIG
+import config
 from llm_handler import LLMHandler
-from mcp_handler import MCPHandler
-# ui.py is imported dynamically in __init__ or main to avoid circular dependency if needed,
-# but direct import is usually fine if structure is correct.
-from ui import AppGUI
+# mcp_handler.py and ui.py are imported in __init__ so that importing this module
+# doesn't load the MCP SDK or tkinter
 
 SYSTEM_PROMPT = """You are 'Assistant', a helpful, conversational AI assistant interacting with a user via a chat interface.
 Your goal is to provide accurate information and complete tasks as requested.
@@ -30,7 +28,30 @@ Your goal is to provide accurate information and complete tasks as requested.
 * Keep responses concise but informative.
 * Acknowledge the use of a tool subtly if it adds clarity (e.g., "According to the travel time tool...").
 * Do not invent information or pretend to have capabilities you lack.
-"""
+""".strip()
+
+# Shared by every conversation; the history only ever holds a reference to it, so never mutate it.
+# (A MappingProxyType would be safer, but the OpenAI SDK expects plain dicts when serializing.)
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+try:
+    import orjson
+
+    def _dumps(obj, indent=False):
+        """Serializes obj to a JSON string, indented by 2 spaces if requested."""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+
+    _loads = orjson.loads
+except ImportError: # orjson is optional, fall back to the standard library
+    def _dumps(obj, indent=False):
+        """Serializes obj to a JSON string, indented by 2 spaces if requested."""
+        return json.dumps(obj, indent=2 if indent else None)
+
+    _loads = json.loads
+
+# Pre-serialized tool responses for the error paths of the tool-call loop
+_ERR_NOT_CONNECTED = _dumps({"error": "MCP server not connected."})
+_ERR_BAD_ARGS = _dumps({"error": "Invalid arguments JSON"})
 
 class AppController:
     """Orchestrates the UI, LLM, and MCP interactions."""
@@ -42,13 +63,19 @@ class AppController:
         Args:
             root: The main Tkinter window (tk.Tk instance).
         """
+        from mcp_handler import MCPHandler
+        from ui import AppGUI
+
         self.root = root
-        self.config = APP_CONFIG # Load config from config.py
-        self.messages = [{"role": "system", "content": SYSTEM_PROMPT}] # Stores the conversation history for the LLM
+        self.messages = [_SYSTEM_MESSAGE] # Stores the conversation history for the LLM
+        self._max_history_msgs = 40 # System prompt + most recent messages sent to the LLM
+        self._last_assistant_id = None # Completion id of the last assistant message added to the history
+        self._bg_tasks = set() # Strong references to running background tasks (asyncio only keeps weak ones)
 
         # --- Initialize Handlers ---
         # Pass a lambda or method reference for UI updates
-        self.mcp_handler = MCPHandler(update_callback=self._handle_handler_update)
+        self.mcp_handler = MCPHandler(update_callback=self._handle_handler_update,
+                                      debug=config.APP_CONFIG["debug"])
         self.llm_handler = LLMHandler()
 
         # --- Initialize UI ---
@@ -69,8 +96,8 @@ class AppController:
 
     def _initialize_llm_from_config(self):
         """Attempts to initialize the LLM using config values."""
-        api_key = self.config.get("api_key")
-        endpoint = self.config.get("endpoint")
+        api_key = config.get_api_key()
+        endpoint = config.get_endpoint()
         success, message = self.llm_handler.initialize(api_key, endpoint)
         self.gui.update_output(message, "system")
         if not success:
@@ -81,7 +108,46 @@ class AppController:
 
     def get_config_value(self, key, default=None):
         """Safely gets a value from the loaded configuration."""
-        return self.config.get(key, default)
+        return config.APP_CONFIG.get(key, default)
+
+    def _trim_history(self):
+        """
+        Keeps the system prompt plus the most recent messages, up to `_max_history_msgs`.
+
+        The latest user message is always kept (on top of that limit), so a turn
+        with many tool rounds doesn't lose the question it is answering.
+        """
+        messages = self.messages
+        if len(messages) <= self._max_history_msgs:
+            return
+        start = len(messages) - self._max_history_msgs + 1
+        last_user = next((i for i in range(len(messages) - 1, 0, -1) if messages[i]["role"] == "user"), None)
+        pinned = [messages[last_user]] if last_user is not None and last_user < start else []
+        # Don't start on tool responses whose assistant tool_calls message was dropped
+        while start < len(messages) and messages[start]["role"] == "tool":
+            start += 1
+        self.messages = [messages[0]] + pinned + messages[start:]
+
+    def _spawn(self, coro):
+        """Runs a coroutine as a background task and keeps a reference to it until it finishes."""
+        task = asyncio.create_task(coro)
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._on_bg_task_done)
+        return task
+
+    def _on_bg_task_done(self, task):
+        """Drops the finished task and reports any exception it raised."""
+        self._bg_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.gui.update_output(f"Background task failed: {task.exception()}", "system")
+
+    async def shutdown(self):
+        """Cancels the background tasks still running and waits for them to finish."""
+        for task in self._bg_tasks:
+            task.cancel()
+        await asyncio.gather(*self._bg_tasks, return_exceptions=True)
+        await self.mcp_handler.close() # Ends the MCP session while the event loop is still running
+        await self.llm_handler.close() # Closes the pooled HTTP connections to Azure OpenAI
 
     # --- Actions Triggered by UI ---
 
@@ -91,13 +157,15 @@ class AppController:
         if not server_script:
             self.gui.update_output("Please specify the MCP server script path.", "system")
             return
+        self.llm_handler.clear_tools_cache()
         # Run the async connection method in the background
-        asyncio.create_task(self.mcp_handler.connect(server_script))
+        self._spawn(self.mcp_handler.connect(server_script))
 
     def disconnect_mcp(self):
         """Handles the 'Disconnect' button click."""
+        self.llm_handler.clear_tools_cache()
          # Run the async disconnect method in the background
-        asyncio.create_task(self.mcp_handler.disconnect())
+        self._spawn(self.mcp_handler.disconnect())
 
 
     def list_mcp_tools(self):
@@ -106,14 +174,12 @@ class AppController:
             self.gui.update_output("Not connected to MCP server.", "system")
             return
         # Run the async list_tools method
-        asyncio.create_task(self.mcp_handler.list_tools(log=True))
+        self._spawn(self.mcp_handler.list_tools(log=True))
 
     def update_azure_config(self, api_key, endpoint, deployment):
         """Handles applying new Azure settings from the UI."""
-        # Update internal config representation (optional, if needed elsewhere)
-        self.config["api_key"] = api_key
-        self.config["endpoint"] = endpoint
-        self.config["deployment"] = deployment
+        # Update the shared config (also refreshes the cached values in config.py)
+        config.set_azure_config(api_key, endpoint, deployment)
         # Re-initialize the LLM client
         self.gui.update_status("Re-initializing LLM...")
         success, message = self.llm_handler.initialize(api_key, endpoint)
@@ -141,10 +207,65 @@ class AppController:
 
         # Start the asynchronous processing in the background
         self.gui.update_status("Processing...")
-        asyncio.create_task(self._process_llm_interaction())
+        self._spawn(self._process_llm_interaction())
 
     # --- Core Asynchronous Logic ---
 
+    async def _stream_llm_response(self, deployment, tools):
+        """
+        Streams one LLM reply into the chat display and assembles it into a message dict.
+
+        Text deltas are shown as they arrive; tool call fragments are joined per
+        `index` as described by the OpenAI streaming protocol.
+
+        Returns:
+            A `(response_id, message)` tuple: the completion id (or a local fallback id)
+            and the assistant message as a dict, ready to be added to `self.messages`.
+        """
+        response_id = None
+        content_parts = []
+        tool_calls = {} # Assembled tool calls, keyed by their index in the reply
+
+        async for completion_id, delta in self.llm_handler.get_completion_stream(
+            deployment=deployment,
+            messages=self.messages,
+            tools=tools
+        ):
+            response_id = response_id or completion_id
+            # Read each delta attribute once; they are pydantic descriptors on SDK objects
+            delta_content = delta.content
+            delta_tool_calls = delta.tool_calls
+            if delta_content:
+                content_parts.append(delta_content)
+                self.gui.update_output(delta_content, "assistant_partial")
+
+            for fragment in delta_tool_calls or []:
+                tool_call = tool_calls.setdefault(fragment.index, {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                })
+                fragment_id = fragment.id
+                if fragment_id:
+                    tool_call["id"] = fragment_id
+                fragment_function = fragment.function
+                if fragment_function:
+                    function = tool_call["function"]
+                    name = fragment_function.name
+                    if name:
+                        function["name"] += name
+                    arguments = fragment_function.arguments
+                    if arguments:
+                        function["arguments"] += arguments
+
+        if content_parts:
+            self.gui.end_partial_output()
+
+        response_dump = {"role": "assistant", "content": "".join(content_parts) or None}
+        if tool_calls:
+            response_dump["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+        return response_id or id(response_dump), response_dump
+
     async def _process_llm_interaction(self):
         """Processes the conversation with the LLM, handling potential tool calls."""
         try:
@@ -163,65 +284,42 @@ class AppController:
                 self.gui.update_output("Not connected to MCP server. Proceeding without tools.", "system")
 
 
+            # Snapshot the deployment once per user message instead of reading the Tk variable every iteration
+            deployment = self.gui.get_azure_config()["deployment"]
+
             max_iterations = 5 # Safety limit for tool call loops
             iterations = 0
 
             while iterations < max_iterations:
                 iterations += 1
                 self.gui.update_status(f"LLM Call {iterations}...")
+                self._trim_history()
 
-                # 2. Call LLM
-                response_message = await self.llm_handler.get_completion(
-                    deployment=self.gui.get_azure_config()["deployment"], # Get current deployment name
-                    messages=self.messages,
+                # 2. Call LLM, streaming the reply into the chat as it arrives
+                response_id, response_dump = await self._stream_llm_response(
+                    deployment=deployment,
                     tools=openai_tool_definitions if openai_tool_definitions else None
                 )
-
-                # Check for errors from get_completion itself
-                if not hasattr(response_message, 'role'): # Basic check if it's not a valid message structure
-                     self.gui.update_output(f"Failed to get LLM response: {response_message}", "system")
-                     break
-
-                # Add response to history *before* processing tool calls
-                # Use model_dump() if available (Pydantic v2) or convert manually
-                response_dump = {}
-                if hasattr(response_message, 'model_dump'):
-                     response_dump = response_message.model_dump(exclude_unset=True) # exclude_unset avoids nulls for non-present fields
-                else: # Manual conversion for older versions or simple objects
-                     response_dump = {
-                          "role": getattr(response_message, 'role', 'assistant'),
-                          "content": getattr(response_message, 'content', None),
-                          "tool_calls": getattr(response_message, 'tool_calls', None)
-                     }
-                     # Clean up None values
-                     response_dump = {k: v for k, v in response_dump.items() if v is not None}
-
-
-                # Display assistant's textual response (if any)
-                if response_message.content:
-                    self.gui.update_output(response_message.content, "assistant")
+                # Bind the fields used below once
+                content = response_dump["content"]
 
                 # 3. Check for Tool Calls
-                tool_calls = getattr(response_message, 'tool_calls', None)
+                tool_calls = response_dump.get("tool_calls")
+
+                # An empty reply won't get better by asking again, so stop right away
+                if not content and not tool_calls:
+                    self.gui.update_output("(No text response and no tool call)", "system")
+                    break
 
                 if not tool_calls:
-                    # No tool calls, conversation turn ends
-                     if not response_message.content: # Handle case where only tool call was expected but didn't happen
-                          self.gui.update_output("(No text response and no tool call)", "system")
-                     break # Exit the loop
+                    break # No tool calls, conversation turn ends
 
 
                 # Add the assistant message with tool calls to history *before* adding tool responses
-                # Ensure the message added includes the tool_calls part
-                if "tool_calls" in response_dump and response_dump["tool_calls"]:
-                     # Check if message already in history to avoid duplicates if logic runs unexpectedly fast
-                     if not self.messages or self.messages[-1] != response_dump:
-                           self.messages.append(response_dump)
-                elif not response_message.content:
-                     # If no content and no tool calls, log and break (already handled above)
-                     # This case might indicate an LLM issue or unexpected state
-                     self.gui.update_output("(Assistant message has no content or tool calls)", "system")
-                     break
+                # Check if message already in history to avoid duplicates if logic runs unexpectedly fast
+                if response_id != self._last_assistant_id:
+                     self.messages.append(response_dump)
+                     self._last_assistant_id = response_id
 
 
                 # 4. Execute Tool Calls
@@ -230,42 +328,51 @@ class AppController:
                      # Add a generic error response for the tool call to messages
                      for tool_call in tool_calls:
                           self.messages.append({
-                               "tool_call_id": tool_call.id,
+                               "tool_call_id": tool_call["id"],
                                "role": "tool",
-                               "name": tool_call.function.name,
-                               "content": json.dumps({"error": "MCP server not connected."})
+                               "name": tool_call["function"]["name"],
+                               "content": _ERR_NOT_CONNECTED
                           })
                      continue # Go to the next LLM iteration with the error
 
 
-                # Process each tool call requested in this turn
-                for tool_call in tool_calls:
-                    function_name = tool_call.function.name
+                # Parse arguments up front so the valid tool calls can run concurrently
+                # JSON response content by position in tool_calls (ids may be missing or repeated)
+                tool_responses = [None] * len(tool_calls)
+                pending_calls = []
+                for index, tool_call in enumerate(tool_calls):
+                    function_name = tool_call["function"]["name"]
+                    raw_args = tool_call["function"]["arguments"]
                     try:
-                        function_args = json.loads(tool_call.function.arguments)
+                        function_args = _loads(raw_args)
                     except json.JSONDecodeError:
-                        self.gui.update_output(f"Error decoding arguments for tool {function_name}: {tool_call.function.arguments}", "system")
-                        tool_response_content = json.dumps({"error": "Invalid arguments JSON"})
+                        self.gui.update_output(f"Error decoding arguments for tool {function_name}: {raw_args}", "system")
+                        tool_responses[index] = _ERR_BAD_ARGS
                     else:
-                        tool_call_display = f"Tool Call:\n  Name: {function_name}\n  Args: {json.dumps(function_args, indent=2)}"
+                        tool_call_display = f"Tool Call:\n  Name: {function_name}\n  Args: {_dumps(function_args, indent=True)}"
                         self.gui.update_output(tool_call_display, "tool_call")
+                        pending_calls.append((index, function_name, function_args))
 
-                        # Call the actual tool via MCP Handler
-                        tool_result = await self.mcp_handler.call_tool(
-                            tool_name=function_name,
-                            arguments=function_args
-                        )
-                        # Result should already be serializable JSON/dict from mcp_handler
-                        tool_response_content = json.dumps(tool_result)
-                        self.gui.update_output(f"Tool Response:\n{json.dumps(tool_result, indent=2)}", "tool_response")
-
-
-                    # Add the tool response message to the history for the next LLM call
+                # Call the actual tools via MCP Handler, all at once
+                tool_results = await asyncio.gather(
+                    *(self.mcp_handler.call_tool(tool_name=function_name, arguments=function_args)
+                      for _, function_name, function_args in pending_calls),
+                    return_exceptions=True
+                )
+                for (index, _, _), tool_result in zip(pending_calls, tool_results):
+                    if isinstance(tool_result, BaseException): # Includes a CancelledError of a single call
+                        tool_result = {"error": str(tool_result)}
+                    # Result should already be serializable JSON/dict from mcp_handler
+                    tool_responses[index] = _dumps(tool_result)
+                    self.gui.update_output(f"Tool Response:\n{_dumps(tool_result, indent=True)}", "tool_response")
+
+                # Add the tool responses to the history for the next LLM call, in the order they were requested
+                for tool_call, tool_response in zip(tool_calls, tool_responses):
                     self.messages.append({
-                        "tool_call_id": tool_call.id,
+                        "tool_call_id": tool_call["id"],
                         "role": "tool",
-                        "name": function_name,
-                        "content": tool_response_content,
+                        "name": tool_call["function"]["name"],
+                        "content": tool_response,
                     })
                 # Loop back to call LLM again with the tool responses included in messages
 
@@ -1,47 +1,101 @@
 # llm_handler.py
+import asyncio
 import json
-from openai import AzureOpenAI, APIError, AuthenticationError
+import logging
+from types import SimpleNamespace
+
+log = logging.getLogger(__name__)
 
 class LLMHandler:
     """Handles interactions with the Azure OpenAI LLM."""
 
     def __init__(self):
         self.llm = None
+        self._close_tasks = set() # Pending closes of replaced clients, referenced until done
+        self._formatted_key = None # Tool names of the cached list below
+        self._formatted_tools = None # Formatted OpenAI tools for the current connection
+
+    def _close_client(self):
+        """Releases the current client and closes its pooled HTTP connections."""
+        old_client, self.llm = self.llm, None
+        if old_client is None:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(old_client.close())
+        except RuntimeError:
+            # No running event loop (startup/shutdown), so no connections can be open
+            return
+        self._close_tasks.add(task)
+        task.add_done_callback(self._close_tasks.discard)
 
     def initialize(self, api_key, endpoint):
         """Initializes the Azure OpenAI client."""
+        # Imported here so that importing this module doesn't pull in the SDK
+        import httpx
+        from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient, APIError, AuthenticationError
+
+        # Don't leak the connections of a client we are replacing
+        self._close_client()
+
         if not api_key or not endpoint:
-            print("Warning: Azure OpenAI client not initialized (missing API key or endpoint).")
+            log.warning("Azure OpenAI client not initialized (missing API key or endpoint).")
             self.llm = None
             return False, "Missing API key or endpoint"
 
         try:
-            self.llm = AzureOpenAI(
+            self.llm = AsyncAzureOpenAI(
                 api_key=api_key,
                 api_version="2024-08-01-preview",
-                azure_endpoint=endpoint
+                azure_endpoint=endpoint,
+                # Set on the SDK client, which passes it to every request (a timeout on the
+                # httpx client would be overridden by the SDK's per-request default)
+                timeout=30.0,
+                # Keep connections alive across the LLM calls of a tool-call loop; the SDK's
+                # default client keeps its other settings (e.g. redirects)
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_keepalive_connections=4, max_connections=8, keepalive_expiry=30),
+                ),
             )
             # Perform a simple test call if needed, or just assume success
-            print("Azure OpenAI client initialized successfully.")
+            log.info("Azure OpenAI client initialized successfully.")
             return True, "Azure OpenAI client initialized."
         except (APIError, AuthenticationError) as e:
-            print(f"Error initializing Azure OpenAI client: {e}")
+            log.error("Error initializing Azure OpenAI client: %s", e)
             self.llm = None
             return False, f"Error initializing Azure OpenAI client: {e}"
         except Exception as e:
-            print(f"Unexpected error initializing Azure OpenAI client: {e}")
+            log.error("Unexpected error initializing Azure OpenAI client: %s", e)
             self.llm = None
             return False, f"Unexpected error initializing Azure OpenAI client: {e}"
 
+    async def close(self):
+        """Closes the current client and waits for all pending closes (on application exit)."""
+        self._close_client()
+        await asyncio.gather(*self._close_tasks, return_exceptions=True)
+
     def is_initialized(self):
         """Checks if the LLM client is initialized."""
         return self.llm is not None
 
+    def clear_tools_cache(self):
+        """Drops the cached tool definitions (e.g. when the MCP server changes)."""
+        self._formatted_key = None
+        self._formatted_tools = None
+
     def format_tools_for_openai(self, mcp_tools):
-        """Formats MCP tools list into OpenAI tool format."""
-        openai_tools = []
+        """
+        Formats MCP tools list into OpenAI tool format.
+
+        One formatted list is cached per connection, keyed by the tool names;
+        clear_tools_cache() is called on connect/disconnect to invalidate it.
+        """
         if not mcp_tools:
             return []
+        key = tuple(tool.name for tool in mcp_tools)
+        if key == self._formatted_key:
+            return self._formatted_tools
+
+        openai_tools = []
         for tool in mcp_tools:
              # Ensure inputSchema exists and is serializable, default to basic object if not
             parameters = getattr(tool, 'inputSchema', {"type": "object", "properties": {}})
@@ -57,33 +111,33 @@ class LLMHandler:
                     "parameters": parameters
                 }
             })
+
+        self._formatted_key = key
+        self._formatted_tools = openai_tools
         return openai_tools
 
-    async def get_completion(self, deployment, messages, tools=None):
-        """Gets a completion from the LLM, potentially using tools."""
+    async def get_completion_stream(self, deployment, messages, tools=None):
+        """
+        Streams a completion from the LLM, yielding `(completion_id, delta)` pairs as they arrive.
+
+        Each delta may carry a piece of `content` and/or `tool_calls` fragments
+        (keyed by `index`) that the caller has to assemble.
+        """
         if not self.llm:
             raise ValueError("LLM client is not initialized.")
 
+        request = {"model": deployment, "messages": messages, "stream": True}
+        if tools:
+            request.update(tools=tools, tool_choice="auto")
+        else:
+            request.update(temperature=0.7, max_tokens=800)
+
         try:
-            if tools:
-                response = self.llm.chat.completions.create(
-                    model=deployment,
-                    messages=messages,
-                    tools=tools,
-                    tool_choice="auto",
-                )
-            else:
-                 response = self.llm.chat.completions.create(
-                    model=deployment,
-                    messages=messages,
-                    temperature=0.7,
-                    max_tokens=800,
-                )
-            return response.choices[0].message
+            stream = await self.llm.chat.completions.create(**request)
+            async for chunk in stream:
+                if chunk.choices: # Azure may send chunks without choices (e.g. content filter results)
+                    yield chunk.id, chunk.choices[0].delta
         except Exception as e:
-            print(f"Error during LLM completion: {e}")
-            # Return a structured error message if possible
-            error_message = {"role": "assistant", "content": f"Error communicating with LLM: {e}"}
-            # Mimic the structure of a message object if needed by the caller
-            from types import SimpleNamespace
-            return SimpleNamespace(role="assistant", content=f"Error communicating with LLM: {e}", tool_calls=None)
\ No newline at end of file
+            log.error("Error during LLM completion: %s", e)
+            # Surface the error as assistant content so the chat shows it
+            yield None, SimpleNamespace(content=f"Error communicating with LLM: {e}", tool_calls=None)
\ No newline at end of file
@@ -1,19 +1,67 @@
 # main.py
 import asyncio
+import logging
+import sys
+import _tkinter
 import tkinter as tk
 from controller import AppController # Import the controller
+try:
+    import uvloop # Faster event loop for the MCP stdio pipes and task switching
+except ImportError: # uvloop is optional and POSIX-only, the default loop is used otherwise
+    uvloop = None
 
 # --- Async Tkinter Loop Helper ---
 # Simple async loop integration. For more complex apps, consider libraries
 # like 'async-tkinter-loop' or 'quamash' if needed, but this often suffices.
-async def async_tkinter_loop(root):
-    """Runs the Tkinter main loop in an async-compatible way."""
+IDLE_POLL_INTERVAL = 0.03 # Time between Tk event pumps while the app is active
+MAX_IDLE_POLL_INTERVAL = 0.15 # The interval doubles up to this while nothing happens, to save CPU when idle
+MAX_EVENTS_PER_PUMP = 100 # Bound on Tk events handled per pump so asyncio tasks aren't starved
+
+async def async_tkinter_loop(root, gui=None):
+    """Runs the Tkinter main loop in an async-compatible way.
+
+    Between Tk event pumps the loop waits on a future instead of a fixed sleep.
+    Async tasks that queue UI work (via the GUI's wakeup hook) resolve it, so
+    their updates are drawn right away rather than on the next polling tick.
+    The polling interval backs off while there are no Tk events or wakeups.
+    """
+    loop = asyncio.get_running_loop()
+    waiter = None
+    poll_interval = IDLE_POLL_INTERVAL
+
+    def wake(delay=0):
+        """Resumes the Tk pump now, or after `delay` seconds (when a Tk timer is due)."""
+        if delay:
+            loop.call_later(delay, wake)
+        elif waiter is not None and not waiter.done():
+            waiter.set_result(True)
+
+    def poll_timeout():
+        """Resumes the Tk pump when the poll interval has elapsed without a wakeup."""
+        if not waiter.done():
+            waiter.set_result(False)
+
+    if gui is not None:
+        gui.set_wakeup(wake)
+
     while True:
         try:
-            # Process Tkinter events without blocking
-            root.update()
-            # Yield control to the asyncio event loop
-            await asyncio.sleep(0.03) # Adjust sleep time as needed (30-50ms is common)
+            # Process Tkinter events without blocking: deferred redraws first, then only the
+            # events that are actually pending
+            root.update_idletasks()
+            handled = 0
+            while handled < MAX_EVENTS_PER_PUMP and root.tk.dooneevent(_tkinter.DONT_WAIT):
+                handled += 1
+            # Yield control to the asyncio event loop until woken or the poll interval elapses
+            waiter = loop.create_future()
+            timer = loop.call_later(poll_interval, poll_timeout)
+            woken = await waiter
+            timer.cancel()
+            # Poll quickly while there is activity, back off while idle
+            if woken or handled:
+                poll_interval = IDLE_POLL_INTERVAL
+            else:
+                poll_interval = min(poll_interval * 2, MAX_IDLE_POLL_INTERVAL)
         except tk.TclError as e:
              # Handle window closure gracefully
              if "application has been destroyed" in str(e):
@@ -27,29 +75,37 @@ async def async_tkinter_loop(root):
              break # Exit on other errors
 
 
+async def run_app(root, controller):
+    """Runs the UI loop, then lets the controller's background tasks wind down."""
+    try:
+        await async_tkinter_loop(root, controller.gui)
+    finally:
+        # Tasks winding down below still report to the UI, which must not touch the destroyed root
+        controller.gui.mark_closed()
+        await controller.shutdown()
+
+
 # --- Main Application Setup ---
 def main():
     """Sets up and runs the application."""
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
     root = tk.Tk()
     controller = AppController(root) # Create the controller, which creates the GUI
 
     # Start the combined Tkinter and asyncio loop
     try:
         print("Starting application loop...")
-        asyncio.run(async_tkinter_loop(root))
+        if uvloop is not None and sys.version_info >= (3, 12):
+            # Selected per run via loop_factory; event loop policies are deprecated
+            asyncio.run(run_app(root, controller), loop_factory=uvloop.new_event_loop)
+        else:
+            asyncio.run(run_app(root, controller))
     except KeyboardInterrupt:
         print("\nApplication interrupted by user.")
     finally:
         print("Application shutting down.")
-        # Perform any cleanup if necessary (e.g., ensure MCP connection is closed)
-        # Note: The MCP connection *should* be handled by its context manager
-        # or the disconnect logic, but final checks can be added here.
-        # Example: Check if mcp_handler task is running and cancel it
-        if controller.mcp_handler._connection_task and not controller.mcp_handler._connection_task.done():
-             print("Cancelling active MCP connection task...")
-             controller.mcp_handler._connection_task.cancel()
-             # Give it a moment to process cancellation (optional)
-             # asyncio.run(asyncio.sleep(0.1))
+        # The MCP connection is closed by controller.shutdown() inside run_app(),
+        # before asyncio.run() closes the event loop.
 
 
 if __name__ == "__main__":
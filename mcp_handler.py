@@ -1,33 +1,61 @@
 # mcp_handler.py
 import asyncio
 import json
+import logging
+import os
 import traceback
 import anyio
 from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 
+log = logging.getLogger(__name__)
+
+DISCONNECT_TIMEOUT = 2.0 # Seconds to wait for a session to be torn down before giving up on waiting
+
+# Serializers for tool result content, looked up by exact type
+_CONTENT_HANDLERS = {
+    types.TextContent: lambda item: {"type": "text", "text": item.text},
+    # Decide how to represent image: path, base64, etc.
+    # For now, just indicate an image was received.
+    # Current SDKs describe the image by mimeType, older ones had a format field
+    types.ImageContent: lambda item: {"type": "image", "format": getattr(item, "mimeType", None) or getattr(item, "format", None), "description": "Image data (not serialized)"},
+}
+if hasattr(types, "JsonContent"): # Not defined by every version of the MCP SDK
+    _CONTENT_HANDLERS[types.JsonContent] = lambda item: {"type": "json", "json": item.json_value}
+
+def _serialize_content(item):
+    """Converts one tool result content item into a JSON-serializable dict."""
+    handler = _CONTENT_HANDLERS.get(type(item))
+    # Handle other potential types or just represent as string
+    return handler(item) if handler else {"type": "unknown", "content": str(item)}
+
 class MCPHandler:
     """Handles interactions with the MCP server."""
 
-    def __init__(self, update_callback):
+    def __init__(self, update_callback, debug=False):
         """
         Initializes the MCPHandler.
 
         Args:
             update_callback: A function to call for sending status/log updates to the UI.
                              Expected signature: update_callback(message: str, role: str)
+            debug: If True, tracebacks of failed tool calls/listings are also shown in the chat.
+                   They always go to the logger at DEBUG level.
         """
         self.session = None
+        self._connected = False # True once the session is initialized, until the runner ends
         self._update_callback = update_callback
-        self._connection_task = None
+        self._debug = debug
+        self._cmd_q = asyncio.Queue() # ("connect", path) / ("disconnect", None) commands for the supervisor
+        self._supervisor = None # Started on first connect(); no event loop is running yet at this point
+        self._idle = asyncio.Event() # Set while no session is starting or running
+        self._idle.set()
+        self._cancel_scope = None # Scope around the session, inside the stdio transport
+        self._cancel_pending = False # disconnect() arrived before the scope existed
 
     def is_connected(self):
-        """Checks if the MCP connection task is active and session object exists."""
-        # Check if the session object was successfully created AND
-        # if the background task managing the connection is still running.
-        return (self.session is not None and
-                self._connection_task is not None and
-                not self._connection_task.done())
+        """Checks if an initialized MCP session is open (a plain flag read, it's on every tool call)."""
+        return self._connected
 
     def _log(self, message, role="system"):
         """Uses the callback to log messages."""
@@ -36,9 +64,27 @@ class MCPHandler:
         else:
             print(f"[{role.upper()}] {message}") # Fallback to console
 
+    async def _supervise(self):
+        """
+        Long-lived task that executes the queued connection commands in order.
+
+        A "connect" runs the session in place, so the supervisor is busy until that
+        session ends; the session itself reads the commands that arrive meanwhile.
+        """
+        while True:
+            cmd, arg = await self._cmd_q.get()
+            if cmd == "connect":
+                try:
+                    await self._mcp_session_runner(arg)
+                finally:
+                    self._idle.set()
+            # A "disconnect" without a running session has nothing to do
+
     async def _mcp_session_runner(self, server_script_path):
-        """The core task that maintains the MCP connection."""
+        """Maintains one MCP connection until a disconnect command arrives or it fails."""
         try:
+            if self._cancel_pending:
+                return # Disconnected before the server was even started
             self._log(f"Attempting to start MCP server: {server_script_path}")
             # Basic check if the script path seems valid (optional)
             # if not os.path.exists(server_script_path): # Requires importing os
@@ -50,7 +96,9 @@ class MCPHandler:
                 command="uv",
                  # Ensure server.py is in the correct relative path or use absolute path
                 args=["run", "--with", "mcp", "mcp", "run", server_script_path],
-                env=None # Inherit environment
+                # Inherit environment, but pin the child's stdio encoding so large
+                # tool payloads aren't re-encoded differently per platform
+                env={**os.environ, "PYTHONIOENCODING": "utf-8"}
             )
             # Construct the command line string manually for logging
             cmd_parts = [server_params.command] + server_params.args
@@ -58,91 +106,91 @@ class MCPHandler:
 
             async with stdio_client(server_params) as (read, write):
                 self._log("MCP transport initialized.")
-                async with ClientSession(read, write) as session:
-                    self._log("MCP session created.")
-                    self.session = session
-                    await session.initialize()
-                    self._log("MCP session initialized successfully.")
-
-                    # Optionally list tools upon connection
-                    # await self.list_tools()
-
-                    self._update_callback("Connected", "status") # Update status bar via controller
-
-                    # Keep the session context alive. This task will exit automatically
-                    # when the stdio_client or ClientSession contexts exit
-                    # (e.g., on connection close or error).
-                    # We just need to yield control periodically.
-                    while True:
-                        # This loop will be broken when an exception (like ClosedResourceError)
-                        # is raised by the context managers exiting the 'try' block,
-                        # or if the task is cancelled.
-                        await asyncio.sleep(1) # Sleep for a second to yield control
+                # disconnect() cancels this scope rather than the task: the cancellation ends
+                # here, so the session is torn down before stdio_client closes its streams
+                # and the transport exits normally instead of unwinding a CancelledError.
+                self._cancel_scope = anyio.CancelScope()
+                with self._cancel_scope:
+                    if self._cancel_pending:
+                        self._cancel_scope.cancel() # disconnect() came while the transport was starting
+                    async with ClientSession(read, write) as session:
+                        self._log("MCP session created.")
+                        self.session = session
+                        await session.initialize()
+                        self._connected = True
+                        self._log("MCP session initialized successfully.")
+
+                        # Optionally list tools upon connection
+                        # await self.list_tools()
+
+                        self._update_callback("Connected", "status") # Update status bar via controller
+
+                        # Keep the session context alive until a "disconnect" command arrives.
+                        # The contexts still exit early if they raise (e.g. ClosedResourceError)
+                        # or if the scope/supervisor is cancelled.
+                        while (await self._cmd_q.get())[0] != "disconnect":
+                            self._log("Already connected or connection attempt in progress.", "system")
 
         except FileNotFoundError:
              self._log(f"Error: 'uv' command not found. Make sure uv is installed and in your PATH.", "system")
-        except anyio.ClosedResourceError:
+        except (anyio.ClosedResourceError, anyio.BrokenResourceError):
             self._log("MCP connection was closed (likely by the server).", "system")
         except Exception as e:
             self._log(f"MCP connection error: {str(e)}", "system")
             self._log(f"Traceback: {traceback.format_exc()}", "system")
         finally:
-            self._log("MCP connection closed.", "system")
+            # Reset the state before reporting, so a failing UI callback can't leave it stale
+            self._connected = False
             self.session = None
-            self._connection_task = None
+            self._cancel_scope = None
+            self._cancel_pending = False
+            self._log("MCP connection closed.", "system")
             self._update_callback("Disconnected", "status") # Update status bar via controller
 
     async def connect(self, server_script_path):
         """Initiates the connection to the MCP server."""
-        if self.is_connected() or self._connection_task:
+        if not self._idle.is_set():
             self._log("Already connected or connection attempt in progress.", "system")
             return
 
+        if self._supervisor is None or self._supervisor.done():
+            self._supervisor = asyncio.create_task(self._supervise(), name="mcp_supervisor")
         self._update_callback("Connecting...", "status") # Update status bar via controller
-        # Run the connection logic in a background task
-        self._connection_task = asyncio.create_task(
-            self._mcp_session_runner(server_script_path),
-            name="mcp_session_runner"
-        )
-        # Optionally, add a callback for when the task finishes/fails
-        self._connection_task.add_done_callback(self._handle_connection_task_completion)
-
-    def _handle_connection_task_completion(self, task):
-        """Callback executed when the connection task finishes."""
-        try:
-            task.result() # Raise exceptions if the task failed
-            self._log("MCP connection task finished normally.", "system")
-        except asyncio.CancelledError:
-            self._log("MCP connection task was cancelled.", "system")
-        except Exception as e:
-            self._log(f"MCP connection task failed: {e}", "system")
-            # Log traceback if needed self._log(f"Traceback: {traceback.format_exc()}", "system")
-        finally:
-            # Ensure state is cleaned up regardless of how the task ended
-            self.session = None
-            self._connection_task = None
-            if self._update_callback: # Check if callback exists before calling
-                 self._update_callback("Disconnected", "status")
-
+        self._idle.clear()
+        await self._cmd_q.put(("connect", server_script_path))
 
     async def disconnect(self):
         """Disconnects from the MCP server."""
-        if self._connection_task and not self._connection_task.done():
-            self._connection_task.cancel()
+        if not self._idle.is_set():
+            if not self._connected:
+                # Still starting up and not reading commands yet, so cancel instead
+                if self._cancel_scope is not None:
+                    self._cancel_scope.cancel()
+                else:
+                    self._cancel_pending = True # No scope yet; the runner cancels once it has one
+            else:
+                await self._cmd_q.put(("disconnect", None))
             try:
-                await self._connection_task # Wait for cancellation
-            except asyncio.CancelledError:
-                self._log("MCP connection cancelled.", "system")
-        if self.session and not self.session.is_closed:
-            try:
-                 # MCP session doesn't have an explicit close, relies on transport closing
-                 pass # stdio_client context manager handles process termination
-            except Exception as e:
-                 self._log(f"Error during MCP session shutdown (ignored): {e}", "system")
-        self.session = None
-        self._connection_task = None
+                # Wait for the session to be torn down, but don't hang the UI on a slow server exit;
+                # the supervisor still finishes the teardown and reports it in the background
+                await asyncio.wait_for(self._idle.wait(), timeout=DISCONNECT_TIMEOUT)
+            except asyncio.TimeoutError:
+                self._log("MCP server is slow to shut down, continuing in the background.", "system")
+                return
         self._update_callback("Disconnected", "status")
 
+    async def close(self):
+        """Stops the supervisor task (ending any open session) when the application exits."""
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            # Only this wait is bounded, so close() itself returns promptly; a teardown still
+            # running afterwards is cancelled and awaited again by asyncio.run() on exit
+            try:
+                await asyncio.wait_for(asyncio.gather(self._supervisor, return_exceptions=True), timeout=DISCONNECT_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            self._supervisor = None
+
     async def list_tools(self, log=False):
         """Lists available tools from the connected MCP server."""
         if not self.is_connected():
@@ -152,23 +200,24 @@ class MCPHandler:
         try:
             tools_result = await self.session.list_tools()
             tools_list = tools_result.tools
-            # Format for display/logging
-            tools_dict_for_log = {
-                "tools": [
-                    {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "parameters": getattr(tool, 'inputSchema', None) # Use getattr for safety
-                    } for tool in tools_list
-                ]
-            }
-            # Log the tools if requested
+            # Log the tools if requested (only then is the display dict built)
             if log:
+                tools_dict_for_log = {
+                    "tools": [
+                        {
+                            "name": tool.name,
+                            "description": tool.description,
+                            "parameters": getattr(tool, 'inputSchema', None) # Use getattr for safety
+                        } for tool in tools_list
+                    ]
+                }
                 self._log(f"Available tools:\n{json.dumps(tools_dict_for_log, indent=2)}", "system")
             return tools_list # Return the raw list
         except Exception as e:
             self._log(f"Error listing tools: {str(e)}", "system")
-            self._log(traceback.format_exc(), "system")
+            log.debug("Error listing tools", exc_info=True) # Only formatted if DEBUG is enabled
+            if self._debug: # Walking the stack is only worth it when debugging
+                self._log(traceback.format_exc(), "system")
             return None
 
     async def call_tool(self, tool_name, arguments):
@@ -178,29 +227,18 @@ class MCPHandler:
             return {"error": "Not connected to MCP server."}
 
         try:
-            # self._log(f"Calling tool: {tool_name} with args: {json.dumps(arguments, indent=2)}", "system")
+            # self._log(f"Calling tool: {tool_name} with args: {json.dumps(arguments, separators=(',', ':'))}", "system")
             tool_result = await self.session.call_tool(tool_name, arguments=arguments)
 
             # Process result for serialization (handle different content types)
-            serializable_content = []
-            for item in tool_result.content:
-                 if isinstance(item, types.TextContent): # Check specific type
-                     serializable_content.append({"type": "text", "text": item.text})
-                 elif isinstance(item, types.JsonContent):
-                      serializable_content.append({"type": "json", "json": item.json_value})
-                 elif isinstance(item, types.ImageContent):
-                      # Decide how to represent image: path, base64, etc.
-                      # For now, just indicate an image was received.
-                      serializable_content.append({"type": "image", "format": item.format, "description": "Image data (not serialized)"})
-                 else:
-                      # Handle other potential types or just represent as string
-                      serializable_content.append({"type": "unknown", "content": str(item)})
-
+            serializable_content = [_serialize_content(item) for item in tool_result.content]
 
             # self._log(f"Tool '{tool_name}' response: {json.dumps(serializable_content, indent=2)}", "system")
             return serializable_content # Return the processed, serializable result
 
         except Exception as e:
             self._log(f"Error calling tool '{tool_name}': {str(e)}", "system")
-            self._log(traceback.format_exc(), "system")
+            log.debug("Error calling tool %r", tool_name, exc_info=True)
+            if self._debug:
+                self._log(traceback.format_exc(), "system")
             return {"error": str(e)}
\ No newline at end of file
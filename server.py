@@ -1,14 +1,81 @@
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import asyncio
 import random
-import requests
+import httpx
 from dotenv import load_dotenv, find_dotenv
 import os
 
 load_dotenv()
-mcp = FastMCP("Bing Search and Travel", instructions="Output in Markdown format")
+
+@asynccontextmanager
+async def _lifespan(server):
+    """
+    Opens the HTTP client shared by a session's tool calls, so HTTPS connections to Bing/Azure Maps
+    are pooled and kept alive between calls. The lifespan runs once per session, so each gets its own.
+    """
+    async with httpx.AsyncClient(
+        timeout=httpx.Timeout(10.0, connect=3.05),
+        limits=httpx.Limits(max_keepalive_connections=8),
+    ) as client:
+        yield {"http": client}
+
+def _http(ctx):
+    """Returns the session's shared HTTP client from the lifespan context."""
+    return ctx.request_context.lifespan_context["http"]
+
+mcp = FastMCP("Bing Search and Travel", instructions="Output in Markdown format", lifespan=_lifespan)
+
+# (subscription key, normalized query) -> position, least recently used first
+_GEOCODE_CACHE = OrderedDict()
+_GEOCODE_CACHE_SIZE = 512
+
+_EMPTY = {} # Shared read-only default for missing nested objects in API responses
+
+try:
+    import orjson
+
+    def _parse_json(response):
+        """Parses a JSON response body; orjson reads the raw bytes without decoding to str first."""
+        return orjson.loads(response.content)
+except ImportError: # orjson is optional
+    def _parse_json(response):
+        """Parses a JSON response body."""
+        return response.json()
+
+async def _geocode(http, subscription_key, query):
+    """
+    Returns the Azure Maps position ({'lat', 'lon'}) of a free-form address, or None if not found.
+
+    Found positions are cached (LRU) on the normalized query since the same places get asked for
+    repeatedly; misses aren't cached, they may be transient.
+    """
+    key = (subscription_key, query.strip().casefold())
+    if key in _GEOCODE_CACHE:
+        _GEOCODE_CACHE.move_to_end(key)
+        return _GEOCODE_CACHE[key]
+
+    search_url = "https://atlas.microsoft.com/search/address/json"
+    search_params = {
+        "api-version": "1.0",
+        "subscription-key": subscription_key,
+        "query": query # As typed: casefolding can change non-ASCII addresses (e.g. ß -> ss)
+    }
+    response = await http.get(search_url, params=search_params)
+    response.raise_for_status()
+    results = _parse_json(response).get("results")
+    if not results:
+        return None
+    position = results[0]['position']
+
+    _GEOCODE_CACHE[key] = position
+    if len(_GEOCODE_CACHE) > _GEOCODE_CACHE_SIZE:
+        _GEOCODE_CACHE.popitem(last=False)
+    return position
 
 @mcp.tool()
-def bing_search(query: str, count: int = 5) -> str:
+async def bing_search(ctx: Context, query: str, count: int = 5) -> str:
     """Search the web using Bing Search API"""
     api_key = os.environ.get("BING_SEARCH_API_KEY")
     if not api_key:
@@ -19,9 +86,9 @@ def bing_search(query: str, count: int = 5) -> str:
     params = {"q": query, "count": count, "responseFilter": "Webpages"}
     
     try:
-        response = requests.get(search_url, headers=headers, params=params)
+        response = await _http(ctx).get(search_url, headers=headers, params=params)
         response.raise_for_status()
-        search_results = response.json()
+        search_results = _parse_json(response)
         
         results = []
         if "webPages" in search_results and "value" in search_results["webPages"]:
@@ -33,33 +100,24 @@ def bing_search(query: str, count: int = 5) -> str:
         return f"Search error: {str(e)}"
 
 @mcp.tool()
-def get_travel_time(origin: str, destination: str, mode: str = "car") -> str:
+async def get_travel_time(ctx: Context, origin: str, destination: str, mode: str = "car") -> str:
     """Calculate travel time between two places using Azure Maps"""
     subscription_key = os.environ.get("AZURE_MAPS_API_KEY")
     if not subscription_key:
         raise ValueError("AZURE_MAPS_API_KEY environment variable is not set")
     
     try:
-        search_url = "https://atlas.microsoft.com/search/address/json"
-        search_params = {
-            "api-version": "1.0",
-            "subscription-key": subscription_key,
-            "query": origin
-        }
-        response = requests.get(search_url, params=search_params)
-        response.raise_for_status()
-        origin_data = response.json()
-        if not origin_data.get("results"):
+        http = _http(ctx)
+        # Both geocodes are independent, so run them concurrently
+        origin_point, dest_point = await asyncio.gather(
+            _geocode(http, subscription_key, origin),
+            _geocode(http, subscription_key, destination)
+        )
+        if origin_point is None:
             return f"Could not find location: {origin}"
-        origin_point = origin_data['results'][0]['position']
         
-        search_params["query"] = destination
-        response = requests.get(search_url, params=search_params)
-        response.raise_for_status()
-        dest_data = response.json()
-        if not dest_data.get("results"):
+        if dest_point is None:
             return f"Could not find location: {destination}"
-        dest_point = dest_data['results'][0]['position']
         
         route_url = "https://atlas.microsoft.com/route/directions/json"
         route_params = {
@@ -69,9 +127,9 @@ def get_travel_time(origin: str, destination: str, mode: str = "car") -> str:
             "travelMode": mode
         }
         
-        response = requests.get(route_url, params=route_params)
+        response = await http.get(route_url, params=route_params)
         response.raise_for_status()
-        route_data = response.json()
+        route_data = _parse_json(response)
         
         if "routes" in route_data and route_data["routes"]:
             route = route_data["routes"][0]
@@ -93,27 +151,19 @@ def get_travel_time(origin: str, destination: str, mode: str = "car") -> str:
         return f"Error calculating travel time: {str(e)}"
 
 @mcp.tool()
-def find_hotels(address: str, radius_km: float = 2.0, limit: int = 5) -> str:
+async def find_hotels(ctx: Context, address: str, radius_km: float = 2.0, limit: int = 5) -> str:
     """Find hotels near a specified address"""
     subscription_key = os.environ.get("AZURE_MAPS_API_KEY")
     if not subscription_key:
         raise ValueError("AZURE_MAPS_API_KEY environment variable is not set")
     
     try:
-        search_url = "https://atlas.microsoft.com/search/address/json"
-        search_params = {
-            "api-version": "1.0",
-            "subscription-key": subscription_key,
-            "query": address
-        }
-        response = requests.get(search_url, params=search_params)
-        response.raise_for_status()
-        location_data = response.json()
+        http = _http(ctx)
+        location = await _geocode(http, subscription_key, address)
         
-        if not location_data.get("results"):
+        if location is None:
             return f"Could not find location: {address}"
             
-        location = location_data['results'][0]['position']
         lat, lon = location['lat'], location['lon']
         
         poi_url = "https://atlas.microsoft.com/search/poi/json"
@@ -127,18 +177,18 @@ def find_hotels(address: str, radius_km: float = 2.0, limit: int = 5) -> str:
             "limit": limit
         }
         
-        response = requests.get(poi_url, params=poi_params)
+        response = await http.get(poi_url, params=poi_params)
         response.raise_for_status()
-        hotel_data = response.json()
+        hotel_data = _parse_json(response)
         
-        results = []
-        if "results" in hotel_data and hotel_data["results"]:
-            for hotel in hotel_data["results"]:
-                name = hotel.get("poi", {}).get("name", "Unknown Hotel")
-                address_text = hotel.get("address", {}).get("freeformAddress", "Address unknown")
-                distance = hotel.get("dist", 0) / 1000  # Convert meters to km
-                
-                results.append(f"🏨 {name}\nAddress: {address_text}\nDistance: {distance:.2f} km")
+        results = [
+            "🏨 %s\nAddress: %s\nDistance: %.2f km" % (
+                (hotel.get("poi") or _EMPTY).get("name", "Unknown Hotel"),
+                (hotel.get("address") or _EMPTY).get("freeformAddress", "Address unknown"),
+                hotel.get("dist", 0) / 1000  # Convert meters to km
+            )
+            for hotel in (hotel_data.get("results") or ())[:limit]
+        ]
         
         if results:
             return f"Found {len(results)} hotels near {address}:\n\n" + "\n\n".join(results)
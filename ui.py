@@ -1,7 +1,36 @@
 # ui.py
+import collections
+import functools
 import tkinter as tk
+from tkinter import font as tkfont
 from tkinter import scrolledtext, ttk, filedialog, Menu, Toplevel
 
+OUTPUT_FLUSH_MS = 16 # Queued chat messages are drawn at most once per frame (~60 FPS)
+MAX_DISPLAY_LINES = 5000 # Older lines are dropped from the chat display
+MAX_HISTORY_MESSAGES = 20000 # Messages kept (beyond what is displayed) for "Save Log"
+
+@functools.lru_cache(None)
+def _configure_styles_once(root):
+    """Configure ttk styles (per-interpreter Tk state, so this only needs to run once per root)."""
+    style = ttk.Style(root)
+    style.theme_use('clam') # Or 'alt', 'default', 'classic'
+
+    style.configure("TFrame", background="#f5f5f5")
+    style.configure("TLabel", background="#f5f5f5", font=("Segoe UI", 10))
+    style.configure("TButton", padding=5, font=("Segoe UI", 10))
+    style.configure("TLabelframe", background="#f5f5f5", padding=10)
+    style.configure("TLabelframe.Label", background="#f5f5f5", font=("Segoe UI", 10, "bold"))
+    # Add more style configurations as needed
+
+@functools.lru_cache(None)
+def _chat_tag_fonts(root):
+    """Builds the chat role tag fonts once per root (fonts belong to that root's Tk interpreter)."""
+    return {
+        "user": tkfont.Font(root=root, family="Segoe UI", size=10, weight="bold"),
+        "system": tkfont.Font(root=root, family="Segoe UI", size=9, slant="italic"),
+        "tool": tkfont.Font(root=root, family="Consolas", size=9),
+    }
+
 class AppGUI:
     """Handles the Tkinter GUI elements and layout."""
 
@@ -15,6 +44,15 @@ class AppGUI:
         """
         self.root = root
         self.controller = controller
+        self._wakeup = None # Set by the async loop so queued updates are drawn promptly
+        self._closed = False # Set once the Tk loop has exited; later updates are dropped
+        self._streaming = False # True while a streamed assistant reply is being appended
+        self._pending_output = collections.deque() # (text, role) messages waiting to be drawn
+        self._flush_scheduled = False
+        self._pending_status = None # Latest status text not yet shown; older ones are skipped
+        self._display_empty = True # Whether nothing has been written to the chat display yet
+        self._history = collections.deque(maxlen=MAX_HISTORY_MESSAGES) # (text, role) of every message shown
+        self._stream_parts = [] # Chunks of the streamed reply being displayed, for the history
 
         # --- Tkinter Variables ---
         self.api_key_var = tk.StringVar()
@@ -31,22 +69,10 @@ class AppGUI:
         self.server_script_var.set(self.controller.get_config_value("default_server_script", "server.py"))
 
 
-        self._setup_styles()
+        _configure_styles_once(root)
         self._setup_ui()
         self.status_var.set("Ready") # Set initial status after UI setup
 
-    def _setup_styles(self):
-        """Configure ttk styles."""
-        style = ttk.Style()
-        style.theme_use('clam') # Or 'alt', 'default', 'classic'
-
-        style.configure("TFrame", background="#f5f5f5")
-        style.configure("TLabel", background="#f5f5f5", font=("Segoe UI", 10))
-        style.configure("TButton", padding=5, font=("Segoe UI", 10))
-        style.configure("TLabelframe", background="#f5f5f5", padding=10)
-        style.configure("TLabelframe.Label", background="#f5f5f5", font=("Segoe UI", 10, "bold"))
-        # Add more style configurations as needed
-
     def _setup_ui(self):
         """Creates and arranges the main GUI elements."""
         self.root.title("MCP Client")
@@ -56,6 +82,9 @@ class AppGUI:
         # --- Menubar ---
         menubar = Menu(self.root)
         self.root.config(menu=menubar)
+        file_menu = Menu(menubar, tearoff=0)
+        file_menu.add_command(label="Save Log...", command=self._save_log)
+        menubar.add_cascade(label="File", menu=file_menu)
         config_menu = Menu(menubar, tearoff=0)
         config_menu.add_command(label="Azure OpenAI Settings", command=self._open_azure_settings)
         # Removed MCP settings from menu as it's now inline
@@ -85,15 +114,18 @@ class AppGUI:
         chat_frame.columnconfigure(0, weight=1)
         chat_frame.rowconfigure(0, weight=1)
 
-        self.chat_display = scrolledtext.ScrolledText(chat_frame, wrap=tk.WORD, font=("Consolas", 10), state=tk.DISABLED, bd=0, relief=tk.FLAT, padx=5, pady=5)
+        self.chat_display = scrolledtext.ScrolledText(chat_frame, wrap=tk.WORD, font=("Consolas", 10), state=tk.DISABLED, bd=0, relief=tk.FLAT, padx=5, pady=5,
+                                                      # The display is read-only, so don't keep an undo stack of every insert
+                                                      undo=False, autoseparators=False, maxundo=0)
         self.chat_display.grid(row=0, column=0, sticky="nsew")
 
         # Configure tags for chat roles
-        self.chat_display.tag_config("user", foreground="#0000AA", font=("Segoe UI", 10, "bold"))
+        fonts = _chat_tag_fonts(self.root)
+        self.chat_display.tag_config("user", foreground="#0000AA", font=fonts["user"])
         self.chat_display.tag_config("assistant", foreground="#007700")
-        self.chat_display.tag_config("system", foreground="#880000", font=("Segoe UI", 9, "italic"))
-        self.chat_display.tag_config("tool_call", foreground="#555555", font=("Consolas", 9))
-        self.chat_display.tag_config("tool_response", foreground="#555555", font=("Consolas", 9))
+        self.chat_display.tag_config("system", foreground="#880000", font=fonts["system"])
+        self.chat_display.tag_config("tool_call", foreground="#555555", font=fonts["tool"])
+        self.chat_display.tag_config("tool_response", foreground="#555555", font=fonts["tool"])
 
 
         # --- Input Frame ---
@@ -147,6 +179,24 @@ class AppGUI:
             self.server_script_var.set(file_path)
             self.update_output(f"Server script set to: {file_path}", "system")
 
+    def _save_log(self):
+        """Writes the chat history, including lines no longer displayed, to a text file."""
+        file_path = filedialog.asksaveasfilename(
+            title="Save Chat Log",
+            defaultextension=".txt",
+            filetypes=[("Text Files", "*.txt"), ("All Files", "*.*")]
+        )
+        if not file_path:
+            return
+        try:
+            with open(file_path, "w", encoding="utf-8") as f:
+                for text, role in self._history:
+                    prefix = f"{role.capitalize()}: " if role not in ["system", "tool_call", "tool_response"] else ""
+                    f.write(f"{prefix}{text}\n\n")
+            self.update_output(f"Chat log saved to: {file_path}", "system")
+        except OSError as e:
+            self.update_output(f"Error saving chat log: {e}", "system")
+
 
     def _open_azure_settings(self):
         """Opens a Toplevel window for Azure configuration."""
@@ -192,28 +242,56 @@ class AppGUI:
 
     # --- Public Methods for Controller to Update UI ---
 
-    def update_output(self, text, role="system"):
-        """Appends text to the chat display with specified role formatting."""
-        # Ensure this runs on the main Tkinter thread
-        self.root.after(0, self._update_output_thread_safe, text, role)
+    def set_wakeup(self, callback):
+        """Registers a callback used to wake the async loop when UI work is queued."""
+        self._wakeup = callback
 
-    def _update_output_thread_safe(self, text, role):
-        """Internal method to safely update the chat display."""
-        try:
-            self.chat_display.configure(state=tk.NORMAL)
-            # Add a newline before the message for spacing, unless it's the very first message
-            if self.chat_display.index("end-1c") != "1.0":
-                 self.chat_display.insert(tk.END, "\n")
+    def _request_redraw(self, delay_ms=0):
+        """Wakes the async loop once `delay_ms` have passed, so a Tk callback due by then runs without waiting for the next poll."""
+        if self._wakeup:
+            self._wakeup(delay_ms / 1000)
 
-            # Apply role tag - use specific tags for tool calls/responses
-            if role == "tool_call" or role == "tool_response":
-                 self.chat_display.insert(tk.END, text, role)
-            else:
-                 prefix = f"{role.capitalize()}: " if role not in ["system"] else "" # Add prefix like "User: "
-                 self.chat_display.insert(tk.END, f"{prefix}{text}", role)
+    def mark_closed(self):
+        """Called when the Tk loop has exited; the window is gone, so later updates are ignored."""
+        self._closed = True
 
+    def update_output(self, text, role="system"):
+        """Queues text for the chat display; queued messages are drawn together once per frame."""
+        if self._closed:
+            return
+        self._pending_output.append((text, role))
+        self._schedule_output_flush()
 
-            self.chat_display.insert(tk.END, "\n") # Add newline after for spacing
+    def end_partial_output(self):
+        """Marks the end of a streamed ("assistant_partial") reply."""
+        if self._closed:
+            return
+        self._pending_output.append((None, "assistant_end"))
+        self._schedule_output_flush()
+
+    def _schedule_output_flush(self):
+        """Schedules a flush of the queued messages, unless one is already pending."""
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            # Ensure this runs on the main Tkinter thread
+            self.root.after(OUTPUT_FLUSH_MS, self._flush_output)
+            # Wake the pump when the timer is due (1 ms late, so it isn't missed to clock rounding)
+            self._request_redraw(OUTPUT_FLUSH_MS + 1)
+
+    def _flush_output(self):
+        """Draws all queued messages with a single insert, state toggle and scroll."""
+        self._flush_scheduled = False
+        segments = [] # Alternating text, tag arguments for Text.insert
+        while self._pending_output:
+            self._format_message(segments, *self._pending_output.popleft())
+        if not segments:
+            return
+        try:
+            self.chat_display.configure(state=tk.NORMAL)
+            # Text.insert takes any number of (chars, tags) pairs, so the whole batch is one Tk call
+            self.chat_display.insert(tk.END, *segments)
+            # Keep the text widget from growing without bound over long sessions
+            self.chat_display.delete("1.0", f"end-{MAX_DISPLAY_LINES}lines")
             self.chat_display.see(tk.END) # Scroll to the bottom
             self.chat_display.configure(state=tk.DISABLED)
         except tk.TclError as e:
@@ -221,11 +299,68 @@ class AppGUI:
         except Exception as e:
              print(f"Unexpected error updating output: {e}")
 
+    def _format_message(self, segments, text, role):
+        """Appends the (text, tag) segments that display one message to `segments`."""
+        if role == "assistant_end":
+            if self._streaming:
+                self._end_stream()
+                segments += ("\n", ()) # Same trailing newline as a regular message
+            return
+
+        # Streamed replies are appended in place, the prefix is only added for the first chunk
+        if role == "assistant_partial":
+            if not self._streaming:
+                self._streaming = True
+                if not self._display_empty:
+                     segments += ("\n", ())
+                segments += ("Assistant: ", "assistant")
+            segments += (text, "assistant")
+            self._stream_parts.append(text)
+            self._display_empty = False
+            return
+
+        # Close a streamed reply that was not explicitly ended (e.g. after an error)
+        if self._streaming:
+            self._end_stream()
+            segments += ("\n", ())
+
+        # Add a newline before the message for spacing, unless it's the very first message
+        if not self._display_empty:
+             segments += ("\n", ())
+
+        # Apply role tag - use specific tags for tool calls/responses
+        if role == "tool_call" or role == "tool_response":
+             segments += (text, role)
+        else:
+             prefix = f"{role.capitalize()}: " if role not in ["system"] else "" # Add prefix like "User: "
+             segments += (f"{prefix}{text}", role)
+
+        segments += ("\n", ()) # Add newline after for spacing
+        self._display_empty = False
+        self._history.append((text, role))
+
+    def _end_stream(self):
+        """Closes the streamed reply and records it in the history as one message."""
+        self._streaming = False
+        self._history.append(("".join(self._stream_parts), "assistant"))
+        self._stream_parts.clear()
 
     def update_status(self, text):
-        """Updates the status bar text."""
-        # Ensure this runs on the main Tkinter thread
-        self.root.after(0, self.status_var.set, text)
+        """Updates the status bar text; rapid changes within a frame are drawn once, with the latest text."""
+        if self._closed:
+            return
+        scheduled = self._pending_status is not None
+        self._pending_status = text
+        if not scheduled:
+            # Ensure this runs on the main Tkinter thread
+            self.root.after(OUTPUT_FLUSH_MS, self._flush_status)
+            self._request_redraw(OUTPUT_FLUSH_MS + 1) # Same timing as the output flush
+
+    def _flush_status(self):
+        """Shows the latest queued status text."""
+        if self._pending_status is not None:
+            self.status_var.set(self._pending_status)
+            self._pending_status = None
 
     def get_server_script_path(self):
         """Returns the current server script path from the UI."""